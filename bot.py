@@ -1,14 +1,30 @@
 import os
 import logging
 import asyncio
+import json
+import signal
+import time
+from html import escape
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from itertools import groupby
+from operator import itemgetter
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 
 import aiosqlite
+import msgspec
+import uvloop
+from aiosqlitepool import SQLiteConnectionPool
 from aiogram import Bot, Dispatcher, Router, types
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.client.default import DefaultBotProperties
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError,
+)
 from aiohttp import web
 from typing import Optional
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
@@ -18,201 +34,831 @@ from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_applicati
 # =========================
 API_TOKEN = os.getenv("API_TOKEN")
 DB_PATH = "football_bot.db"
+READ_POOL_SIZE = 4
 
 DEFAULT_PLACE = "Chikovani St."
-TIMEZONE_SHIFT = 4  # GMT+4 (Тбилиси)
+TZ = ZoneInfo("Asia/Tbilisi")
+TIMEZONE_SHIFT = 4  # GMT+4 (Тбилиси); only the old local-time migration uses it
 
 MAIN_CHAT_ID = -1001234567890   # замени на реальный id чата
-ADMIN_IDS = [1969502668, 192472924]
+ADMIN_IDS = frozenset({1969502668, 192472924})
+
+# Optional self-hosted telegram-bot-api server, e.g. http://localhost:8081
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 
 WEBHOOK_PATH = "/webhook"
 WEBHOOK_URL = f"{os.getenv('RENDER_EXTERNAL_URL', 'https://football-on-chikovani-bot.onrender.com')}{WEBHOOK_PATH}"
 
 # =========================
-# Aiogram / Scheduler
+# Aiogram
 # =========================
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:%(message)s")
-bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-dp = Dispatcher()
 router = Router()
-dp.include_router(router)
-scheduler = AsyncIOScheduler()
+
+def create_bot() -> Bot:
+    # msgspec decodes both incoming webhook bodies and Bot API responses
+    session = AiohttpSession(
+        api=TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else PRODUCTION,
+        json_loads=msgspec.json.decode,
+    )
+    # aiogram 3.7 has no public connector options; keep TLS connections to the
+    # Bot API alive between bursts instead of re-handshaking after 15s idle
+    session._connector_init.update(limit=100, ttl_dns_cache=300, keepalive_timeout=75)
+    return Bot(
+        token=API_TOKEN,
+        session=session,
+        default=DefaultBotProperties(parse_mode="HTML"),
+    )
+
+# =========================
+# App context
+# =========================
+# Everything that lives for the process lifetime; built once in main() and
+# handed to handlers through the dispatcher's workflow data.
+@dataclass
+class AppCtx:
+    bot: Bot
+    dp: Dispatcher
+    # Writes go through one connection held for the process lifetime
+    # (SQLite has one writer anyway), reads through a small pool of
+    # query_only connections; all keep their page cache warm between
+    # callbacks instead of reconnecting per query.
+    db: aiosqlite.Connection
+    read_pool: SQLiteConnectionPool
+    write_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    batcher: "MicroBatcher" = field(init=False)
+    renderer: "RenderScheduler" = field(init=False)
+
+    def __post_init__(self):
+        self.renderer = RenderScheduler(self)
+        self.batcher = MicroBatcher(self)
 
 # =========================
 # DB init
 # =========================
-async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS events (
-                id TEXT PRIMARY KEY,
-                time DATETIME,
-                place TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT 1
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS players (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                event_id TEXT,
-                user_id INTEGER,
-                username TEXT,
-                full_name TEXT,
-                extra_count INTEGER DEFAULT 0,
-                going BOOLEAN,
-                joined_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (event_id) REFERENCES events(id)
-            )
-        """)
-        await db.commit()
+async def connect(readonly: bool = False) -> aiosqlite.Connection:
+    db = await aiosqlite.connect(DB_PATH)
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.execute("PRAGMA synchronous=NORMAL")
+    await db.execute("PRAGMA cache_size=-64000")
+    await db.execute("PRAGMA temp_store=MEMORY")
+    await db.execute("PRAGMA busy_timeout=5000")
+    if readonly:
+        await db.execute("PRAGMA query_only=true")
+    return db
+
+# Each entry upgrades the schema by one step; the applied step count is
+# kept in PRAGMA user_version so existing databases are migrated in place.
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS events (
+        id TEXT PRIMARY KEY,
+        time DATETIME,
+        place TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        is_active BOOLEAN DEFAULT 1
+    );
+    CREATE TABLE IF NOT EXISTS players (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id TEXT,
+        user_id INTEGER,
+        username TEXT,
+        full_name TEXT,
+        extra_count INTEGER DEFAULT 0,
+        going BOOLEAN,
+        joined_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (event_id) REFERENCES events(id)
+    );
+    """,
+    # One row per (event, user) so participation is a single UPSERT;
+    # joined_at becomes an epoch set on first join only.
+    """
+    CREATE TABLE players_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id TEXT,
+        user_id INTEGER,
+        username TEXT,
+        full_name TEXT,
+        extra_count INTEGER DEFAULT 0,
+        going BOOLEAN,
+        joined_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+        FOREIGN KEY (event_id) REFERENCES events(id)
+    );
+    INSERT INTO players_new (id, event_id, user_id, username, full_name, extra_count, going, joined_at)
+        SELECT id, event_id, user_id, username, full_name, extra_count, going,
+               CAST(strftime('%s', joined_at) AS INTEGER)
+        FROM players;
+    DROP TABLE players;
+    ALTER TABLE players_new RENAME TO players;
+    CREATE UNIQUE INDEX ux_players_event_user ON players(event_id, user_id);
+    CREATE INDEX ix_events_active_time ON events(is_active, time);
+    """,
+    # Event time as a UTC epoch instead of a local ISO string
+    f"""
+    CREATE TABLE events_new (
+        id TEXT PRIMARY KEY,
+        time INTEGER NOT NULL,
+        place TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        is_active BOOLEAN DEFAULT 1
+    );
+    INSERT INTO events_new (id, time, place, created_at, is_active)
+        SELECT id, CAST(strftime('%s', time) AS INTEGER) - {TIMEZONE_SHIFT * 3600},
+               place, created_at, is_active
+        FROM events;
+    DROP TABLE events;
+    ALTER TABLE events_new RENAME TO events;
+    CREATE INDEX ix_events_active_time ON events(is_active, time);
+    """,
+    # going and extra_count packed into one state column (see pack_state)
+    """
+    CREATE TABLE players_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id TEXT,
+        user_id INTEGER,
+        username TEXT,
+        full_name TEXT,
+        state INTEGER NOT NULL DEFAULT 0,
+        joined_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+        FOREIGN KEY (event_id) REFERENCES events(id)
+    );
+    INSERT INTO players_new (id, event_id, user_id, username, full_name, state, joined_at)
+        SELECT id, event_id, user_id, username, full_name,
+               (COALESCE(extra_count, 0) << 1) | (CASE WHEN going THEN 1 ELSE 0 END),
+               joined_at
+        FROM players;
+    DROP TABLE players;
+    ALTER TABLE players_new RENAME TO players;
+    CREATE UNIQUE INDEX ux_players_event_user ON players(event_id, user_id);
+    """,
+    # Names live once per user instead of on every players row;
+    # each user keeps the name from their most recent answer
+    """
+    CREATE TABLE users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        full_name TEXT,
+        updated_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+    );
+    INSERT INTO users (user_id, username, full_name)
+        SELECT user_id, username, full_name FROM players p
+        WHERE id = (SELECT MAX(id) FROM players WHERE user_id = p.user_id);
+    CREATE TABLE players_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id TEXT,
+        user_id INTEGER,
+        state INTEGER NOT NULL DEFAULT 0,
+        joined_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+        FOREIGN KEY (event_id) REFERENCES events(id)
+    );
+    INSERT INTO players_new (id, event_id, user_id, state, joined_at)
+        SELECT id, event_id, user_id, state, joined_at FROM players;
+    DROP TABLE players;
+    ALTER TABLE players_new RENAME TO players;
+    CREATE UNIQUE INDEX ux_players_event_user ON players(event_id, user_id);
+    """,
+    # (event_id, user_id) is the key every lookup and upsert uses, so make
+    # it the primary key instead of a surrogate id plus a unique index
+    """
+    CREATE TABLE players_new (
+        event_id TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        state INTEGER NOT NULL DEFAULT 0,
+        joined_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+        PRIMARY KEY (event_id, user_id),
+        FOREIGN KEY (event_id) REFERENCES events(id)
+    );
+    INSERT INTO players_new (event_id, user_id, state, joined_at)
+        SELECT event_id, user_id, state, joined_at FROM players ORDER BY id;
+    DROP TABLE players;
+    ALTER TABLE players_new RENAME TO players;
+    """,
+    # Integer event ids instead of creation-timestamp strings; existing
+    # events are numbered in creation order. AUTOINCREMENT keeps a deleted
+    # event's id (and any keyboard still carrying it) from being reused.
+    # The old id stays in legacy_id so cards already in the chat keep working.
+    """
+    CREATE TEMP TABLE event_ids AS
+        SELECT id AS old_id, ROW_NUMBER() OVER (ORDER BY CAST(id AS REAL)) AS new_id
+        FROM events;
+    CREATE TABLE events_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        time INTEGER NOT NULL,
+        place TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        is_active BOOLEAN DEFAULT 1,
+        legacy_id TEXT
+    );
+    INSERT INTO events_new (id, time, place, created_at, is_active, legacy_id)
+        SELECT m.new_id, e.time, e.place, e.created_at, e.is_active, e.id
+        FROM events e JOIN event_ids m ON m.old_id = e.id;
+    CREATE TABLE players_new (
+        event_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        state INTEGER NOT NULL DEFAULT 0,
+        joined_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+        PRIMARY KEY (event_id, user_id),
+        FOREIGN KEY (event_id) REFERENCES events(id)
+    );
+    INSERT INTO players_new (event_id, user_id, state, joined_at)
+        SELECT m.new_id, p.user_id, p.state, p.joined_at
+        FROM players p JOIN event_ids m ON m.old_id = p.event_id
+        ORDER BY p.rowid;
+    DROP TABLE players;
+    DROP TABLE events;
+    ALTER TABLE events_new RENAME TO events;
+    ALTER TABLE players_new RENAME TO players;
+    CREATE INDEX ix_events_active_time ON events(is_active, time);
+    CREATE UNIQUE INDEX ux_events_legacy_id ON events(legacy_id);
+    DROP TABLE event_ids;
+    """,
+    # Renders read an event's players in join order; covering that with an
+    # index skips the sort and the table lookups
+    """
+    CREATE INDEX ix_players_event_joined ON players(event_id, joined_at, user_id, state);
+    """,
+    # Names were stored raw and broke the HTML message when they contained
+    # <, > or &; escape the existing ones the same way new writes are
+    """
+    UPDATE users SET
+        username = REPLACE(REPLACE(REPLACE(username, '&', '&amp;'), '<', '&lt;'), '>', '&gt;'),
+        full_name = REPLACE(REPLACE(REPLACE(full_name, '&', '&amp;'), '<', '&lt;'), '>', '&gt;');
+    """,
+    # Players stored clustered by (event_id, user_id) with no hidden rowid,
+    # so an event's rows sit together in the primary key B-tree
+    """
+    CREATE TABLE players_new (
+        event_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        state INTEGER NOT NULL DEFAULT 0,
+        joined_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+        PRIMARY KEY (event_id, user_id)
+    ) WITHOUT ROWID;
+    INSERT INTO players_new (event_id, user_id, state, joined_at)
+        SELECT event_id, user_id, state, joined_at FROM players;
+    DROP TABLE players;
+    ALTER TABLE players_new RENAME TO players;
+    CREATE INDEX ix_players_event_joined ON players(event_id, joined_at, user_id, state);
+    """,
+    # Second resolution put everyone from one burst of taps on the same
+    # joined_at, listed by user id; the bot now writes nanoseconds taken
+    # when the tap arrives, so the list keeps tap order
+    """
+    CREATE TABLE players_new (
+        event_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        state INTEGER NOT NULL DEFAULT 0,
+        joined_at INTEGER NOT NULL,
+        PRIMARY KEY (event_id, user_id)
+    ) WITHOUT ROWID;
+    INSERT INTO players_new (event_id, user_id, state, joined_at)
+        SELECT event_id, user_id, state, joined_at * 1000000000 FROM players;
+    DROP TABLE players;
+    ALTER TABLE players_new RENAME TO players;
+    CREATE INDEX ix_players_event_joined ON players(event_id, joined_at, user_id, state);
+    """,
+]
+
+async def init_db() -> tuple[aiosqlite.Connection, SQLiteConnectionPool]:
+    db = await connect()
+    async with db.execute("PRAGMA user_version") as cur:
+        (version,) = await cur.fetchone()
+    for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        await db.executescript(f"BEGIN; {script} PRAGMA user_version={number}; COMMIT;")
+    read_pool = SQLiteConnectionPool(
+        connection_factory=lambda: connect(readonly=True),
+        pool_size=READ_POOL_SIZE,
+    )
+    return db, read_pool
+
+async def close_db(ctx: AppCtx):
+    async with ctx.write_lock:
+        await ctx.db.close()
+    await ctx.read_pool.close()
+
+# The shared write connection must not interleave two coroutines'
+# statements inside one transaction, so every write holds the lock.
+# BEGIN IMMEDIATE takes the write lock up front instead of upgrading a
+# read transaction midway; the block commits once, or rolls back on error.
+@asynccontextmanager
+async def writer(ctx: AppCtx):
+    async with ctx.write_lock:
+        db = ctx.db
+        # BEGIN and COMMIT sit inside the try too: a cancelled BEGIN or a
+        # failed COMMIT must not leave the shared connection mid-transaction
+        try:
+            await db.execute("BEGIN IMMEDIATE")
+            yield db
+            await db.commit()
+        except BaseException:
+            try:
+                # Shielded so a second cancellation can't skip it
+                await asyncio.shield(db.rollback())
+            except Exception:
+                logging.exception("Rollback failed")
+            raise
 
 # =========================
 # Utilities
 # =========================
-async def create_event(event_dt: datetime, place: str) -> str:
-    event_id = str(datetime.now().timestamp())
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO events (id, time, place, is_active) VALUES (?,?,?,1)",
-            (event_id, event_dt.isoformat(), place)
+# Event ids arrive as text in callback data and /delevent; only plain ASCII
+# digits that fit a SQLite INTEGER are accepted
+def parse_event_id(text: str) -> Optional[int]:
+    if text.isascii() and text.isdecimal() and len(text) <= 18:
+        return int(text)
+    return None
+
+async def create_event(ctx: AppCtx, event_dt: datetime, place: str) -> int:
+    event_time = int(event_dt.replace(tzinfo=TZ).timestamp())
+    async with writer(ctx) as db:
+        cur = await db.execute(
+            "INSERT INTO events (time, place, is_active) VALUES (?,?,1)",
+            (event_time, place)
         )
-        await db.commit()
+    event_id = cur.lastrowid
+    # Nobody has answered yet, so the announcement can be rendered from
+    # what was just written instead of reading it back
+    ev = {"time": datetime.fromtimestamp(event_time, TZ), "place": place}
+    RENDER_CACHE[event_id] = (render_version(event_id), format_event(ev, []))
     return event_id
 
-async def delete_event(event_id: str) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
+async def delete_event(ctx: AppCtx, event_id: int) -> None:
+    async with writer(ctx) as db:
         await db.execute("DELETE FROM players WHERE event_id=?", (event_id,))
         await db.execute("DELETE FROM events WHERE id=?", (event_id,))
-        await db.commit()
+    RENDER_CACHE.pop(event_id, None)
+    RENDER_VERSION.pop(event_id, None)
+    KB_CACHE.pop(event_id, None)
 
-async def get_event(event_id: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT id, time, place, is_active FROM events WHERE id=?", (event_id,)
-        ) as cur:
+# Maps the timestamp id of an event created before the switch to integer ids
+async def get_legacy_event_id(ctx: AppCtx, legacy_id: str) -> Optional[int]:
+    async with ctx.read_pool.connection() as db:
+        async with db.execute("SELECT id FROM events WHERE legacy_id=?", (legacy_id,)) as cur:
             row = await cur.fetchone()
-            if not row:
-                return None
-            return {
-                "id": row[0],
-                "time": datetime.fromisoformat(row[1]),
-                "place": row[2],
-                "is_active": bool(row[3]),
-            }
-
-async def get_upcoming_events(limit: int = 10):
-    now = datetime.utcnow() + timedelta(hours=TIMEZONE_SHIFT)
-    async with aiosqlite.connect(DB_PATH) as db:
+    return row[0] if row else None
+
+async def get_upcoming_events(ctx: AppCtx, limit: int = 10):
+    async with ctx.read_pool.connection() as db:
         async with db.execute(
             "SELECT id, time, place FROM events "
             "WHERE is_active=1 AND time >= ? "
             "ORDER BY time ASC LIMIT ?",
-            (now.isoformat(), limit),
+            (int(time.time()), limit),
         ) as cur:
             rows = await cur.fetchall()
             return [
-                {"id": r[0], "time": datetime.fromisoformat(r[1]), "place": r[2]}
-                for r in rows
+                {"id": event_id, "time": datetime.fromtimestamp(ts, TZ), "place": place}
+                for event_id, ts, place in rows
             ]
 
-async def get_nearest_event():
-    events = await get_upcoming_events(limit=1)
+async def get_nearest_event(ctx: AppCtx):
+    events = await get_upcoming_events(ctx, limit=1)
     return events[0] if events else None
 
-async def upsert_participation(event_id: str, user_id: int, username: Optional[str],
-                               full_name: str, going: bool, extra_count: int = 0):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "DELETE FROM players WHERE event_id=? AND user_id=?",
-            (event_id, user_id)
-        )
-        await db.execute(
-            "INSERT INTO players (event_id, user_id, username, full_name, extra_count, going) "
-            "VALUES (?, ?, ?, ?, ?, ?)",
-            (event_id, user_id, username, full_name, extra_count, 1 if going else 0)
+# A player's answer is stored as one small int: bit 0 is "going",
+# the remaining bits hold the number of extra players (0-3).
+def pack_state(going: bool, extra_count: int) -> int:
+    return (extra_count << 1) | (1 if going else 0)
+
+# rows: (event_id, user_id, username, full_name, state, joined_at_ns)
+# Returns, per row, whether anything the event message shows actually changed.
+# Names are stored HTML-escaped, so renders can put them into the message as is.
+async def upsert_participations(ctx: AppCtx, rows: list[tuple]) -> list[bool]:
+    async with writer(ctx) as db:
+        changes = db.total_changes
+        # Names rarely change, so the WHERE turns most of these into no-op writes
+        await db.executemany(
+            "INSERT INTO users (user_id, username, full_name) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET "
+            "username=excluded.username, full_name=excluded.full_name, "
+            "updated_at=strftime('%s', 'now') "
+            "WHERE users.username IS NOT excluded.username "
+            "OR users.full_name IS NOT excluded.full_name",
+            [
+                (user_id, username and escape(username, quote=False), escape(full_name, quote=False))
+                for _, user_id, username, full_name, _, _ in rows
+            ]
         )
-        await db.commit()
+        users_changed = db.total_changes != changes
+        # Repeated taps on the same button leave the row untouched; executed
+        # per row (same transaction) so rowcount tells which ones did write
+        changed = []
+        for event_id, user_id, _, _, state, joined_at in rows:
+            cur = await db.execute(
+                "INSERT INTO players (event_id, user_id, state, joined_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(event_id, user_id) DO UPDATE SET state=excluded.state "
+                "WHERE players.state IS NOT excluded.state",
+                (event_id, user_id, state, joined_at)
+            )
+            changed.append(users_changed or cur.rowcount > 0)
+            await cur.close()
+    if users_changed:
+        # A new or renamed user may show up in any cached event
+        invalidate_all_renders()
+    for event_id in {row[0] for row, c in zip(rows, changed) if c}:
+        invalidate_render(event_id)
+    return changed
 
-async def list_players(event_id: str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT username, full_name, extra_count, going FROM players "
-            "WHERE event_id=? ORDER BY joined_at",
-            (event_id,)
-        ) as cur:
-            return await cur.fetchall()
+# sqlite3 keeps a per-connection cache of prepared statements keyed by SQL
+# text, so the render queries are built once here and never vary per call.
+# Display name as shown in the lists: @username, else full name, else a placeholder
+PLAYER_NAME_SQL = "COALESCE('@' || NULLIF(u.username, ''), NULLIF(u.full_name, ''), 'No name')"
+EVENT_WITH_PLAYERS_SQL = (
+    f"SELECT e.time, e.place, {PLAYER_NAME_SQL}, p.state "
+    "FROM events e LEFT JOIN players p ON p.event_id = e.id "
+    "LEFT JOIN users u ON u.user_id = p.user_id "
+    "WHERE e.id=? ORDER BY p.joined_at"
+)
+# Ids are passed as one JSON array so the text is the same for any count
+PLAYERS_BY_EVENT_SQL = (
+    f"SELECT p.event_id, {PLAYER_NAME_SQL}, p.state "
+    "FROM players p LEFT JOIN users u ON u.user_id = p.user_id "
+    "WHERE p.event_id IN (SELECT value FROM json_each(?)) "
+    "ORDER BY p.event_id, p.joined_at"
+)
+
+async def get_event_with_players(ctx: AppCtx, event_id: int):
+    async with ctx.read_pool.connection() as db:
+        async with db.execute(EVENT_WITH_PLAYERS_SQL, (event_id,)) as cur:
+            rows = await cur.fetchall()
+    if not rows:
+        return None, []
+    ev = {"time": datetime.fromtimestamp(rows[0][0], TZ), "place": rows[0][1]}
+    # LEFT JOIN yields a single all-NULL player row when nobody answered yet
+    players = [(name, state) for _, _, name, state in rows if state is not None]
+    return ev, players
+
+async def get_players_by_event(ctx: AppCtx, event_ids: list[int]) -> dict[int, list]:
+    async with ctx.read_pool.connection() as db:
+        async with db.execute(PLAYERS_BY_EVENT_SQL, (json.dumps(event_ids),)) as cur:
+            rows = await cur.fetchall()
+    return {
+        event_id: [(name, state) for _, name, state in group]
+        for event_id, group in groupby(rows, key=itemgetter(0))
+    }
 
 # =========================
 # Keyboards
 # =========================
-def join_keyboard(event_id: str) -> InlineKeyboardMarkup:
+# callback_data is "<kind><arg><event_id>" with a one-char kind ("j" join,
+# "e" extra) and arg, so callbacks() decodes it by slicing. The markup only
+# depends on the id, so every render reuses the same object until the event
+# is deleted.
+KB_CACHE: dict[int, InlineKeyboardMarkup] = {}
+
+def join_keyboard(event_id: int) -> InlineKeyboardMarkup:
+    kb = KB_CACHE.get(event_id)
+    if kb is None:
+        kb = KB_CACHE[event_id] = build_join_keyboard(event_id)
+    return kb
+
+def build_join_keyboard(event_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Going", callback_data=f"join_{event_id}_yes")],
-        [InlineKeyboardButton(text="❌ Not going", callback_data=f"join_{event_id}_no")],
+        [InlineKeyboardButton(text="✅ Going", callback_data=f"jy{event_id}")],
+        [InlineKeyboardButton(text="❌ Not going", callback_data=f"jn{event_id}")],
         [
-            InlineKeyboardButton(text="➕1", callback_data=f"extra_{event_id}_1"),
-            InlineKeyboardButton(text="➕2", callback_data=f"extra_{event_id}_2"),
-            InlineKeyboardButton(text="➕3", callback_data=f"extra_{event_id}_3"),
+            InlineKeyboardButton(text="➕1", callback_data=f"e1{event_id}"),
+            InlineKeyboardButton(text="➕2", callback_data=f"e2{event_id}"),
+            InlineKeyboardButton(text="➕3", callback_data=f"e3{event_id}"),
         ],
     ])
 
 # =========================
 # Render helpers
 # =========================
+# Rendered text per event, tagged with the event's version at read time.
+# Writes bump the version after committing, so a render that raced a write
+# is never served afterwards. RENDER_GENERATION is part of every version and
+# invalidates all events at once (e.g. when a user's name changes).
+RENDER_CACHE: dict[int, tuple[tuple[int, int], str]] = {}
+RENDER_VERSION: dict[int, int] = {}
+RENDER_GENERATION = 0
+
+def render_version(event_id: int) -> tuple[int, int]:
+    return RENDER_GENERATION, RENDER_VERSION.get(event_id, 0)
+
+def invalidate_render(event_id: int) -> None:
+    RENDER_VERSION[event_id] = RENDER_VERSION.get(event_id, 0) + 1
+
+def invalidate_all_renders() -> None:
+    global RENDER_GENERATION
+    RENDER_GENERATION += 1
+
 def fmt_dt(dt: datetime) -> str:
     return dt.strftime("%a, %d %b %H:%M")
 
-async def render_event(event_id: str) -> str:
-    ev = await get_event(event_id)
-    if not ev:
-        return "Event not found."
+def cached_render(event_id: int) -> Optional[str]:
+    cached = RENDER_CACHE.get(event_id)
+    if cached and cached[0] == render_version(event_id):
+        return cached[1]
+    return None
+
+# Fixed parts of the event message, filled with %-formatting per render
+EVENT_HEADER = "⚽ <b>Game</b>\n🕒 %s\n📍 %s\n\n<b>Going (%d/20)</b>:"
+NOT_GOING_HEADER = "\n<b>Not going (%d)</b>:"
 
-    players = await list_players(event_id)
-    going = [(u, f, x) for (u, f, x, g) in players if g == 1]
-    not_going = [(u, f) for (u, f, x, g) in players if g == 0]
+def format_event(ev: dict, players: list) -> str:
+    going, not_going = [], []
+    for name, state in players:
+        if state & 1:
+            going.append((name, state >> 1))
+        else:
+            not_going.append(name)
 
-    lines = []
-    lines.append(f"⚽ <b>Game</b>")
-    lines.append(f"🕒 {fmt_dt(ev['time'])}")
-    lines.append(f"📍 {ev['place']}")
-    lines.append("")
-    lines.append(f"<b>Going ({len(going)}/20)</b>:")
+    lines = [EVENT_HEADER % (fmt_dt(ev["time"]), ev["place"], len(going))]
 
     if going:
-        for username, full_name, extra_count in going:
-            name = f"@{username}" if username else (full_name or 'No name')
-            extra = f" +{extra_count}" if extra_count else ""
-            lines.append(f"✅ {name}{extra}")
+        lines.extend(f"✅ {name} +{extra}" if extra else f"✅ {name}" for name, extra in going)
     else:
         lines.append("Nobody yet 👀")
 
-    lines.append("")
-    lines.append(f"<b>Not going ({len(not_going)})</b>:")
+    lines.append(NOT_GOING_HEADER % len(not_going))
 
     if not_going:
-        for username, full_name in not_going:
-            name = f"@{username}" if username else (full_name or 'No name')
-            lines.append(f"❌ {name}")
+        lines.extend(f"❌ {name}" for name in not_going)
     else:
         lines.append("Nobody declined.")
 
     return "\n".join(lines)
 
+async def render_event(ctx: AppCtx, event_id: int) -> str:
+    text = cached_render(event_id)
+    if text is not None:
+        return text
+
+    version = render_version(event_id)
+    ev, players = await get_event_with_players(ctx, event_id)
+    if not ev:
+        return "Event not found."
+    text = format_event(ev, players)
+    RENDER_CACHE[event_id] = (version, text)
+    return text
+
+# Renders events already loaded by get_upcoming_events, fetching the players
+# of every uncached one with a single query.
+async def render_events(ctx: AppCtx, events: list[dict]) -> list[str]:
+    texts = [cached_render(ev["id"]) for ev in events]
+    missing = [ev for ev, text in zip(events, texts) if text is None]
+    if not missing:
+        return texts
+
+    versions = {ev["id"]: render_version(ev["id"]) for ev in missing}
+    players = await get_players_by_event(ctx, [ev["id"] for ev in missing])
+    for i, ev in enumerate(events):
+        if texts[i] is None:
+            texts[i] = format_event(ev, players.get(ev["id"], []))
+            RENDER_CACHE[ev["id"]] = (versions[ev["id"]], texts[i])
+    return texts
+
+# Returns whether the message now shows `text`. Flood control, network and
+# Telegram server errors propagate so the caller can retry them.
+async def edit_event_message(message: types.Message, event_id: int, text: str) -> bool:
+    try:
+        await message.edit_text(text, reply_markup=join_keyboard(event_id))
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e):
+            return True
+        logging.warning(f"Failed to edit event {event_id}: {e}")
+        return False
+    return True
+
+# =========================
+# Background work
+# =========================
+# Caps detached Telegram calls; spawn() waits for a slot before creating the
+# task, so a burst applies backpressure instead of piling up tasks in memory.
+BACKGROUND_LIMIT = asyncio.Semaphore(200)
+_background_tasks: set[asyncio.Task] = set()
+
+def _background_done(task: asyncio.Task) -> None:
+    _background_tasks.discard(task)
+    BACKGROUND_LIMIT.release()
+    if not task.cancelled() and task.exception():
+        logging.error("Background task failed", exc_info=task.exception())
+
+async def spawn(coro) -> None:
+    await BACKGROUND_LIMIT.acquire()
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_done)
+
+async def cancel_and_wait(tasks) -> None:
+    tasks = list(tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+# =========================
+# Message re-rendering
+# =========================
+MessageKey = tuple[int, int]  # (chat_id, message_id)
+
+# Re-renders a changed event once taps on it pause for `interval` (or after
+# `max_delay` during a continuous burst) and edits every message that was
+# tapped meanwhile; edits that wouldn't change the text are skipped.
+class RenderScheduler:
+    def __init__(self, ctx: AppCtx, interval: float = 0.25, max_delay: float = 1.0):
+        self.ctx = ctx
+        self.interval = interval
+        self.max_delay = max_delay
+        self._dirty: dict[int, asyncio.Event] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._messages: dict[int, dict[MessageKey, types.Message]] = {}
+        self._last_sent: dict[int, dict[MessageKey, int]] = {}
+
+    def mark_dirty(self, event_id: int, message: types.Message) -> None:
+        self._messages.setdefault(event_id, {})[(message.chat.id, message.message_id)] = message
+        if event_id not in self._dirty:
+            self._dirty[event_id] = asyncio.Event()
+            self._tasks[event_id] = asyncio.create_task(self._run(event_id))
+        self._dirty[event_id].set()
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        # Cleared first so failed edits still in flight don't re-mark anything
+        self._dirty.clear()
+        self._tasks.clear()
+        self._messages.clear()
+        await cancel_and_wait(tasks)
+
+    def forget(self, event_id: int) -> None:
+        task = self._tasks.pop(event_id, None)
+        if task:
+            task.cancel()
+        self._dirty.pop(event_id, None)
+        self._messages.pop(event_id, None)
+        self._last_sent.pop(event_id, None)
+
+    async def _run(self, event_id: int) -> None:
+        loop = asyncio.get_running_loop()
+        dirty = self._dirty[event_id]
+        last_sent = self._last_sent.setdefault(event_id, {})
+        while True:
+            await dirty.wait()
+            deadline = loop.time() + self.max_delay
+            while True:
+                dirty.clear()
+                await asyncio.sleep(min(self.interval, max(deadline - loop.time(), 0)))
+                if not dirty.is_set() or loop.time() >= deadline:
+                    break
+            # Taps marked before this point are committed, so one render covers them
+            dirty.clear()
+            messages = self._messages.pop(event_id, {})
+            try:
+                text = await render_event(self.ctx, event_id)
+                digest = hash(text)
+                for key, message in messages.items():
+                    if last_sent.get(key) == digest:
+                        continue
+                    await spawn(self._edit(event_id, key, message, text))
+            except Exception:
+                # Keep the task alive and retry these messages a bit later;
+                # anything marked meanwhile is newer and wins
+                logging.exception(f"Failed to re-render event {event_id}")
+                pending = self._messages.setdefault(event_id, {})
+                for key, message in messages.items():
+                    pending.setdefault(key, message)
+                await asyncio.sleep(self.max_delay)
+                dirty.set()
+
+    async def _edit(self, event_id: int, key: MessageKey, message: types.Message, text: str) -> None:
+        try:
+            if await edit_event_message(message, event_id, text):
+                # Only a delivered edit may suppress the next identical one
+                last_sent = self._last_sent.get(event_id)
+                if last_sent is not None:
+                    last_sent[key] = hash(text)
+            return
+        except TelegramRetryAfter as e:
+            logging.warning(f"Flood control while editing event {event_id}, retrying in {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            logging.warning(f"Failed to edit event {event_id}, retrying: {e}")
+            await asyncio.sleep(self.max_delay)
+        # Render it again unless the event was deleted meanwhile
+        if event_id in self._dirty:
+            self.mark_dirty(event_id, message)
+
+# =========================
+# Participation batching
+# =========================
+@dataclass
+class PendingJoin:
+    event_id: int
+    user_id: int
+    username: Optional[str]
+    full_name: str
+    going: bool
+    extra_count: int
+    joined_at: int  # time.time_ns() when the tap arrived
+    message: Optional[types.Message]  # None for taps on inline-mode messages
+    future: asyncio.Future
+
+# Collects participation updates for up to max_wait_ms (or max_batch_size items),
+# writes them in one transaction and hands the touched messages to the renderer.
+class MicroBatcher:
+    def __init__(self, ctx: AppCtx, max_batch_size: int = 32, max_wait_ms: int = 20):
+        self.ctx = ctx
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        # None is the shutdown sentinel queued by stop()
+        self._queue: asyncio.Queue[Optional[PendingJoin]] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run_loop())
+
+    async def submit(self, event_id: int, user_id: int, username: Optional[str], full_name: str,
+                     going: bool, extra_count: int, message: Optional[types.Message]) -> bool:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(PendingJoin(event_id, user_id, username, full_name,
+                                          going, extra_count, time.time_ns(), message, future))
+        return await future
+
+    async def stop(self) -> None:
+        # Writes whatever is already queued, then ends the loop
+        await self._queue.put(None)
+        await self._task
+
+    async def _run_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            stopping = any(p is None for p in batch)
+            batch = [p for p in batch if p is not None]
+            if not batch:
+                continue
+            # The loop must survive anything a flush throws, otherwise every
+            # later submit() would wait forever
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logging.exception("Failed to flush participation batch")
+                for p in batch:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+
+    async def _flush(self, batch: list[PendingJoin]) -> None:
+        rows = [
+            (p.event_id, p.user_id, p.username, p.full_name,
+             pack_state(p.going, p.extra_count), p.joined_at)
+            for p in batch
+        ]
+        try:
+            results: list = await upsert_participations(self.ctx, rows)
+        except Exception as e:
+            if len(rows) == 1:
+                logging.exception("Failed to write participation")
+                results = [e]
+            else:
+                # The batch was rolled back; retry row by row so a bad row
+                # only fails its own tap
+                results = []
+                for row in rows:
+                    try:
+                        results.extend(await upsert_participations(self.ctx, [row]))
+                    except Exception as row_error:
+                        logging.exception("Failed to write participation")
+                        results.append(row_error)
+
+        for p, result in zip(batch, results):
+            if p.future.done():
+                continue
+            if isinstance(result, Exception):
+                p.future.set_exception(result)
+            else:
+                p.future.set_result(result)
+
+        for p, result in zip(batch, results):
+            if result is True and p.message is not None:
+                self.ctx.renderer.mark_dirty(p.event_id, p.message)
+
 # =========================
 # Commands
 # =========================
+START_TEXT = (
+    "⚽ <b>Hello! I'm your football bot.</b>\n\n"
+    "<b>Commands:</b>\n"
+    "/events — list active games\n"
+    "/addevent YYYY-MM-DD HH:MM — add custom event (admin)\n"
+    "/delevent EVENT_ID — delete an event by ID (admin)\n"
+    "/myid — show your Telegram ID\n"
+    "/chatid — show this chat ID"
+)
+
 @router.message(Command("start"))
 async def cmd_start(message: types.Message):
-    await message.answer(
-        "⚽ <b>Hello! I'm your football bot.</b>\n\n"
-        "<b>Commands:</b>\n"
-        "/events — list active games\n"
-        "/addevent YYYY-MM-DD HH:MM — add custom event (admin)\n"
-        "/delevent EVENT_ID — delete an event by ID (admin)\n"
-        "/myid — show your Telegram ID\n"
-        "/chatid — show this chat ID"
-    )
+    await message.answer(START_TEXT)
 
 @router.message(Command("myid"))
 async def cmd_myid(message: types.Message):
@@ -223,18 +869,18 @@ async def cmd_chatid(message: types.Message):
     await message.answer(f"Chat ID is: <code>{message.chat.id}</code>")
 
 @router.message(Command("events"))
-async def cmd_events(message: types.Message):
-    events = await get_upcoming_events(limit=10)
+async def cmd_events(message: types.Message, ctx: AppCtx):
+    events = await get_upcoming_events(ctx, limit=10)
     if not events:
         await message.answer("No active games.")
         return
 
-    for ev in events:
-        text = await render_event(ev["id"])
+    # Sent one by one so the games stay in chronological order in the chat
+    for ev, text in zip(events, await render_events(ctx, events)):
         await message.answer(text, reply_markup=join_keyboard(ev["id"]))
 
 @router.message(Command("addevent"))
-async def cmd_addevent(message: types.Message):
+async def cmd_addevent(message: types.Message, ctx: AppCtx):
     if message.from_user.id not in ADMIN_IDS:
         return
     parts = message.text.split(maxsplit=2)
@@ -244,60 +890,113 @@ async def cmd_addevent(message: types.Message):
     dt_str = f"{parts[1]} {parts[2]}"
     try:
         local_dt = datetime.strptime(dt_str, "%Y-%m-%d %H:%M")
-        event_id = await create_event(local_dt, DEFAULT_PLACE)
-        text = await render_event(event_id)
-        await bot.send_message(MAIN_CHAT_ID, f"⚽ <b>New game created!</b>\n\n{text}",
+        event_id = await create_event(ctx, local_dt, DEFAULT_PLACE)
+        text = await render_event(ctx, event_id)
+        await ctx.bot.send_message(MAIN_CHAT_ID, f"⚽ <b>New game created!</b>\n\n{text}",
                                reply_markup=join_keyboard(event_id))
     except ValueError:
         await message.answer("Invalid format. Use: /addevent YYYY-MM-DD HH:MM")
 
 @router.message(Command("delevent"))
-async def cmd_delevent(message: types.Message):
+async def cmd_delevent(message: types.Message, ctx: AppCtx):
     if message.from_user.id not in ADMIN_IDS:
         return
     parts = message.text.split(maxsplit=1)
-    if len(parts) != 2:
+    event_id = parse_event_id(parts[1]) if len(parts) == 2 else None
+    if event_id is None:
         await message.answer("Usage: /delevent EVENT_ID")
         return
-    await delete_event(parts[1])
+    await delete_event(ctx, event_id)
+    ctx.renderer.forget(event_id)
     await message.answer("Event deleted.")
 
 # =========================
 # Callbacks
 # =========================
+LEGACY_CALLBACK_ARGS = {"yes": "y", "no": "n", "1": "1", "2": "2", "3": "3"}
+
 @router.callback_query()
-async def callbacks(callback: CallbackQuery):
-    try:
-        data = callback.data.split("_")
-        action = data[0]
-        event_id = data[1]
-    except Exception:
-        await callback.answer()
+async def callbacks(callback: CallbackQuery, ctx: AppCtx):
+    data = callback.data or ""
+    kind, arg, raw_id = data[:1], data[1:2], data[2:]
+    action, sep, rest = data.partition("_")
+    if sep and action in ("join", "extra"):
+        # Cards posted before the compact format: "join_<id>_yes", "extra_<id>_2"
+        raw_id, _, legacy_arg = rest.rpartition("_")
+        kind, arg = action[0], LEGACY_CALLBACK_ARGS.get(legacy_arg, "")
+
+    event_id = parse_event_id(raw_id)
+    if event_id is None and raw_id:
+        # Timestamp ids from before events were renumbered
+        event_id = await get_legacy_event_id(ctx, raw_id)
+    if event_id is None:
+        await callback.answer("This card is outdated, use /events")
         return
 
     full_name = f"{callback.from_user.first_name or ''} {callback.from_user.last_name or ''}".strip()
     username = callback.from_user.username
 
-    if action == "join":
-        going = (data[2] == "yes")
-        await upsert_participation(event_id, callback.from_user.id, username, full_name, going, extra_count=0)
-        text = await render_event(event_id)
-        await callback.message.edit_text(text, reply_markup=join_keyboard(event_id))
-        await callback.answer("Updated!")
-    elif action == "extra":
-        extra = int(data[2])
-        await upsert_participation(event_id, callback.from_user.id, username, full_name, True, extra_count=extra)
-        text = await render_event(event_id)
-        await callback.message.edit_text(text, reply_markup=join_keyboard(event_id))
-        await callback.answer(f"Added +{extra}")
+    if kind == "j" and arg in ("y", "n"):
+        going = (arg == "y")
+        if await ctx.batcher.submit(event_id, callback.from_user.id, username, full_name,
+                                    going, 0, callback.message):
+            await callback.answer("Updated!")
+        else:
+            await callback.answer("Already set")
+    elif kind == "e" and arg in ("1", "2", "3"):
+        extra = int(arg)
+        if await ctx.batcher.submit(event_id, callback.from_user.id, username, full_name,
+                                    True, extra, callback.message):
+            await callback.answer(f"Added +{extra}")
+        else:
+            await callback.answer("Already set")
     else:
         await callback.answer()
 
 # =========================
 # Scheduler tasks
 # =========================
-async def scheduled_create_48h():
-    now_local = datetime.utcnow() + timedelta(hours=TIMEZONE_SHIFT)
+# Games are announced on Wednesday and Saturday at 21:00 Tbilisi time
+CREATE_WEEKDAYS = (2, 5)
+CREATE_HOUR = 21
+
+scheduled_tasks: set[asyncio.Task] = set()
+
+def local_now() -> datetime:
+    return datetime.now(TZ)
+
+async def run_at(when: datetime, coro) -> None:
+    try:
+        await asyncio.sleep(when.timestamp() - time.time())
+    except asyncio.CancelledError:
+        coro.close()
+        raise
+    await coro
+
+def schedule_at(when: datetime, coro) -> None:
+    task = asyncio.create_task(run_at(when, coro))
+    scheduled_tasks.add(task)
+    task.add_done_callback(scheduled_tasks.discard)
+
+def next_create_time(after: datetime) -> datetime:
+    day = after.replace(hour=CREATE_HOUR, minute=0, second=0, microsecond=0)
+    while day <= after or day.weekday() not in CREATE_WEEKDAYS:
+        day += timedelta(days=1)
+    return day
+
+async def create_events_periodically(ctx: AppCtx):
+    when = local_now()
+    while True:
+        # Advance from the previous slot, not the clock, so an early wakeup
+        # can't fire the same slot twice
+        when = next_create_time(when)
+        try:
+            await run_at(when, scheduled_create_48h(ctx))
+        except Exception:
+            logging.exception("Scheduled event creation failed")
+
+async def scheduled_create_48h(ctx: AppCtx):
+    now_local = local_now()
     weekday = now_local.weekday()
 
     if weekday == 2:  # Wednesday
@@ -308,54 +1007,71 @@ async def scheduled_create_48h():
         return
 
     event_dt = target.replace(hour=21, minute=0, second=0, microsecond=0)
-    event_id = await create_event(event_dt, DEFAULT_PLACE)
-    text = await render_event(event_id)
-    await bot.send_message(
+    event_id = await create_event(ctx, event_dt, DEFAULT_PLACE)
+    text = await render_event(ctx, event_id)
+    await ctx.bot.send_message(
         MAIN_CHAT_ID,
         "⚽ <b>New game created!</b>\n\n" + text,
         reply_markup=join_keyboard(event_id)
     )
 
     reminder_time = event_dt - timedelta(hours=3)
-    scheduler.add_job(send_reminder, "date", run_date=reminder_time, args=[event_id])
+    schedule_at(reminder_time, send_reminder(ctx, event_id))
 
-async def send_reminder(event_id: str):
-    text = await render_event(event_id)
-    await bot.send_message(MAIN_CHAT_ID, "⏰ Reminder: Game soon!\n\n" + text)
+async def send_reminder(ctx: AppCtx, event_id: int):
+    text = await render_event(ctx, event_id)
+    await ctx.bot.send_message(MAIN_CHAT_ID, "⏰ Reminder: Game soon!\n\n" + text)
 
 # =========================
 # Main with webhook
 # =========================
-async def on_startup(bot: Bot):
-    await bot.set_webhook(WEBHOOK_URL)
+async def on_startup(bot: Bot, dp: Dispatcher):
+    # Only deliver update types some handler listens to; the rest would be
+    # decoded and dropped on every POST
+    await bot.set_webhook(WEBHOOK_URL, allowed_updates=dp.resolve_used_update_types())
 
 async def main():
-    await init_db()
-
-    scheduler.add_job(
-        scheduled_create_48h,
-        "cron",
-        day_of_week="wed,sat",
-        hour=21,
-        minute=0,
-        timezone="Asia/Tbilisi",
-    )
-    scheduler.start()
+    db, read_pool = await init_db()
+    dp = Dispatcher()
+    dp.include_router(router)
+    ctx = AppCtx(bot=create_bot(), dp=dp, db=db, read_pool=read_pool)
+    dp.workflow_data.update(ctx=ctx)
+    ctx.batcher.start()
+
+    cron_task = asyncio.create_task(create_events_periodically(ctx))
 
     app = web.Application()
-    SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=WEBHOOK_PATH)
-    setup_application(app, dp, bot=bot)
+    webhook = SimpleRequestHandler(dispatcher=dp, bot=ctx.bot, handle_in_background=True)
+    webhook.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=ctx.bot)
 
-    runner = web.AppRunner(app)
+    runner = web.AppRunner(app, access_log=None)
     await runner.setup()
     site = web.TCPSite(runner, "0.0.0.0", int(os.getenv("PORT", "10000")))
     await site.start()
 
     logging.info(f"Webhook set at {WEBHOOK_URL}")
-    await on_startup(bot)
+    await on_startup(ctx.bot, dp)
 
-    while True:
-        await asyncio.sleep(3600)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+    await stop_event.wait()
+
+    logging.info("Shutting down")
+    # Stop taking updates, let handlers already running finish (the batcher
+    # still answers them), then write what's queued. Only after every task
+    # that talks to Telegram or SQLite is gone are the session and DB closed.
+    await site.stop()
+    # aiogram has no public way to wait for handle_in_background tasks
+    await asyncio.gather(*webhook._background_feed_update_tasks, return_exceptions=True)
+    await ctx.batcher.stop()
+    await cancel_and_wait([cron_task, *scheduled_tasks])
+    await ctx.renderer.stop()
+    await cancel_and_wait(_background_tasks)
+    await runner.cleanup()  # also closes the bot session
+    await close_db(ctx)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    uvloop.run(main())